@@ -14,16 +14,118 @@
 # ==============================================================================
 """Utilities to help with mesh creation."""
 
-from typing import List, Optional, Tuple
+import functools
+from typing import Any, List, Optional, Tuple
+import weakref
 from absl import logging
 import numpy as np
 
 from tensorflow.dtensor import python as dtensor
 from tensorflow.dtensor.python import tpu_util
+from tensorflow.python.eager import context
 from tensorflow.python.framework import config as tf_config
 from tensorflow.python.framework import device as tf_device
 
 
+# A weak reference to the eager context whose devices are currently cached.
+# Resetting the context (e.g. between tests) allows a new device configuration,
+# so the device caches are only valid for as long as the same context is live.
+# The reference is weak so that a replaced context can be garbage collected.
+_cached_context_ref = None
+
+
+def _maybe_invalidate_device_cache() -> None:
+  """Clears the device caches if the eager context has been replaced."""
+  global _cached_context_ref
+  ctx = context.context()
+  if _cached_context_ref is None or _cached_context_ref() is not ctx:
+    invalidate_device_cache()
+    _cached_context_ref = weakref.ref(ctx)
+
+
+@functools.lru_cache(maxsize=None)
+def _list_logical_devices(device_type: str) -> Tuple[Any, ...]:
+  return tuple(tf_config.list_logical_devices(device_type))
+
+
+def _cached_logical_devices(device_type: str) -> Tuple[Any, ...]:
+  """Returns the logical devices of device_type, enumerated once per context."""
+  _maybe_invalidate_device_cache()
+  return _list_logical_devices(device_type)
+
+
+def _local_devices(device_type: str,
+                   for_client_id: int) -> List[tf_device.DeviceSpec]:
+  """Same as `dtensor.local_devices`, but using the cached logical devices."""
+  job = dtensor.job_name()
+  device_count = 0
+  for d in _cached_logical_devices(device_type):
+    # d might have a partial name, e.g. /device:TPU:0.
+    spec = tf_device.DeviceSpec.from_string(d.name)
+    if (spec.job is None or spec.job == job) and (spec.task is None or
+                                                  spec.task == for_client_id):
+      device_count += 1
+
+  return [
+      tf_device.DeviceSpec(  # pylint: disable=g-complex-comprehension
+          job=job,
+          replica=0,
+          task=for_client_id,
+          device_type=device_type,
+          device_index=i) for i in range(device_count)
+  ]
+
+
+def invalidate_device_cache() -> None:
+  """Clears the cached device enumerations used by the mesh builders.
+
+  The caches are cleared automatically when the eager context is reset. Call
+  this to force a fresh enumeration within the same context.
+  """
+  _list_logical_devices.cache_clear()
+  # The num_global_devices default falls back to counting local devices.
+  _reset_env_cache()
+
+
+# Environment-derived defaults, each parsed on first use. num_global_devices
+# falls back to counting local devices, so these caches are cleared together
+# with the device caches when the eager context is replaced.
+
+
+@functools.lru_cache(maxsize=None)
+def _env_num_global_devices(device_type: str) -> int:
+  return dtensor.num_global_devices(device_type)
+
+
+@functools.lru_cache(maxsize=None)
+def _env_num_clients() -> int:
+  return dtensor.num_clients()
+
+
+@functools.lru_cache(maxsize=None)
+def _env_client_id() -> int:
+  return dtensor.client_id()
+
+
+def _reset_env_cache() -> None:
+  """Clears the cached environment defaults, e.g. for tests mutating env."""
+  _env_num_global_devices.cache_clear()
+  _env_num_clients.cache_clear()
+  _env_client_id.cache_clear()
+
+
+class _LazyDeviceList(object):
+  """Stringifies a list of DeviceSpecs only when a log message is emitted."""
+
+  def __init__(self, devices: List[tf_device.DeviceSpec]):
+    self._devices = devices
+
+  def __str__(self) -> str:
+    return str([d.to_string() for d in self._devices])
+
+  __repr__ = __str__
+
+
 def _print_context(num_global_devices: int, num_clients: int, client_id: int,
                    device_type: str, mesh: dtensor.Mesh) -> None:
   logging.info('This is client %d of %d clients', client_id, num_clients)
@@ -32,8 +134,7 @@ def _print_context(num_global_devices: int, num_clients: int, client_id: int,
   # pylint: disable=protected-access
   logging.info('Global device IDs: %s', mesh._global_device_ids)
   logging.info('Local device IDs: %s', mesh._local_device_ids)
-  logging.info('Local devices: %s',
-               [d.to_string() for d in mesh._local_devices])
+  logging.info('Local devices: %s', _LazyDeviceList(mesh._local_devices))
   # pylint: enable=protected-access
 
 
@@ -65,7 +166,7 @@ def create_mesh(mesh_dims: Optional[List[Tuple[str, int]]] = None,
       device_type = 'CPU'
     devices = [
         tf_device.DeviceSpec.from_string(d.name)
-        for d in tf_config.list_logical_devices(device_type)
+        for d in _cached_logical_devices(device_type)
     ]
   else:
     devices = [
@@ -85,8 +186,8 @@ def create_mesh(mesh_dims: Optional[List[Tuple[str, int]]] = None,
 
   dim_names = [d[0] for d in mesh_dims]
   shape = [d[1] for d in mesh_dims]
-  global_device_ids = np.arange(len(devices)).reshape(shape)
-  local_device_ids = np.ravel(global_device_ids).tolist()
+  global_device_ids = np.arange(len(devices), dtype=np.int32).reshape(shape)
+  local_device_ids = list(range(len(devices)))
   mesh = dtensor.Mesh(
       dim_names=dim_names,
       global_device_ids=global_device_ids,
@@ -128,27 +229,34 @@ def create_distributed_mesh(mesh_dims: List[Tuple[str, int]],
       corresponding environment variable.
     client_id: This client's ID. Defaults to the corresponding environment
       variable.
+
+  Environment variables are read when a default is first needed and the value
+  is reused for the lifetime of the current eager context. Changes to the
+  environment after that are not picked up until the context is reset or
+  `_reset_env_cache()` is called.
     device_type: Type of device to build the mesh for. Defaults to 'CPU'.
 
   Returns:
     A single-client mesh created from specified or default arguments.
   """
-  if device_type.upper() in ['CPU', 'GPU']:
+  device_type_upper = device_type.upper()
+  _maybe_invalidate_device_cache()
+  if device_type_upper in ('CPU', 'GPU'):
     # For CPU and GPU meshes, user-specified args take precedence over env vars.
     # This is particularly useful on single clients when users want to create
     # meshes that use fewer logical devices than what's available.
     if num_global_devices is None:
-      num_global_devices = dtensor.num_global_devices(device_type)
+      num_global_devices = _env_num_global_devices(device_type)
     if num_global_devices <= 0:
       raise ValueError(f'num_global_devices ({num_global_devices}) must be > 0')
 
     if num_clients is None:
-      num_clients = dtensor.num_clients()
+      num_clients = _env_num_clients()
     if num_clients <= 0:
       raise ValueError(f'num_clients ({num_clients}) must be > 0')
 
     if client_id is None:
-      client_id = dtensor.client_id()
+      client_id = _env_client_id()
     if client_id < 0:
       raise ValueError(f'client_id ({client_id}) must be >= 0')
     if client_id >= num_clients:
@@ -161,19 +269,22 @@ def create_distributed_mesh(mesh_dims: List[Tuple[str, int]],
 
     # It's allowed to create a CPU or GPU mesh using fewer logical devices than
     # what's available. If so, just use the first N logical devices.
-    num_available_devices = dtensor.num_local_devices(device_type)
+    local_devices = _local_devices(device_type, client_id)
+    num_available_devices = len(local_devices)
     if num_local_devices > num_available_devices:
       raise ValueError(f'Not enough devices; {num_local_devices} needed, '
                        f'only {num_available_devices} available')
-    local_devices = dtensor.local_devices(device_type,
-                                          client_id)[:num_local_devices]
+    local_devices = local_devices[:num_local_devices]
 
     dim_names = [d[0] for d in mesh_dims]
     shape = [d[1] for d in mesh_dims]
-    global_device_ids = np.arange(num_global_devices).reshape(shape)
-    flattened = np.ravel(global_device_ids).tolist()
+    if np.prod(shape) != num_global_devices:
+      raise ValueError(f'Mesh shape {shape} does not match num_global_devices '
+                       f'({num_global_devices})')
+    global_device_ids = np.arange(
+        num_global_devices, dtype=np.int32).reshape(shape)
     start_idx = num_local_devices * client_id
-    local_device_ids = flattened[start_idx:start_idx + num_local_devices]
+    local_device_ids = list(range(start_idx, start_idx + num_local_devices))
 
     mesh = dtensor.Mesh(
         dim_names=dim_names,
@@ -185,30 +296,22 @@ def create_distributed_mesh(mesh_dims: List[Tuple[str, int]],
                    mesh)
     return mesh
 
-  if device_type.upper() == 'TPU':
+  if device_type_upper == 'TPU':
     # TPU meshes can only be configured through environment variables that
     # reflect the actual TPU topology. Do not let users specify custom args.
-    if num_global_devices is not None:
-      raise ValueError(
-          f'Do not specify num_global_devices for {device_type.upper()} meshes. '
-          'It will be filled in automatically from environmental variables.'
-          'See api.py for the list of environmental variables for DTensor.')
-    if num_clients is not None:
-      raise ValueError(
-          f'Do not specify num_clients for {device_type.upper()} meshes. '
-          'It will be filled in automatically from environmental variables.'
-          'See api.py for the list of environmental variables for DTensor.')
-    if client_id is not None:
-      raise ValueError(
-          f'Do not specify client_id for {device_type.upper()} meshes. '
-          'It will be filled in automatically from environmental variables.'
-          'See api.py for the list of environmental variables for DTensor.')
+    for name, value in (('num_global_devices', num_global_devices),
+                        ('num_clients', num_clients), ('client_id', client_id)):
+      if value is not None:
+        raise ValueError(
+            f'Do not specify {name} for {device_type_upper} meshes. '
+            'It will be filled in automatically from environmental variables.'
+            'See api.py for the list of environmental variables for DTensor.')
     dim_names = [mesh_dim[0] for mesh_dim in mesh_dims]
     shape = [mesh_dim[1] for mesh_dim in mesh_dims]
     mesh = tpu_util.create_tpu_mesh(dim_names, shape, mesh_name)
     _print_context(
-        dtensor.num_global_devices(device_type), dtensor.num_clients(),
-        dtensor.client_id(), device_type, mesh)
+        _env_num_global_devices(device_type), _env_num_clients(),
+        _env_client_id(), device_type, mesh)
     return mesh
 
   raise ValueError(f'Device type {device_type} is not CPU, GPU or TPU')
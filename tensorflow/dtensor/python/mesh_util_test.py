@@ -0,0 +1,140 @@
+# Copyright 2026 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for mesh_util."""
+
+import os
+from unittest import mock
+import weakref
+
+from tensorflow.dtensor.python import mesh_util
+from tensorflow.python.eager import context
+from tensorflow.python.framework import config as tf_config
+from tensorflow.python.framework import device as tf_device
+from tensorflow.python.platform import test
+
+
+def _configure_logical_cpus(num_cpus):
+  cpus = tf_config.list_physical_devices('CPU')
+  tf_config.set_logical_device_configuration(
+      cpus[0], [context.LogicalDeviceConfiguration()] * num_cpus)
+
+
+class MeshUtilTest(test.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    context._reset_context()  # pylint: disable=protected-access
+    mesh_util._reset_env_cache()  # pylint: disable=protected-access
+
+  def tearDown(self):
+    context._reset_context()  # pylint: disable=protected-access
+    super().tearDown()
+
+  def testCreateMeshAfterContextReset(self):
+    _configure_logical_cpus(2)
+    self.assertEqual(mesh_util.create_mesh().num_local_devices(), 2)
+
+    context._reset_context()  # pylint: disable=protected-access
+    _configure_logical_cpus(4)
+    self.assertEqual(mesh_util.create_mesh().num_local_devices(), 4)
+
+  def testCreateDistributedMeshAfterContextReset(self):
+    _configure_logical_cpus(2)
+    mesh = mesh_util.create_distributed_mesh([('x', 2)])
+    self.assertEqual(mesh.num_local_devices(), 2)
+
+    context._reset_context()  # pylint: disable=protected-access
+    _configure_logical_cpus(4)
+    mesh = mesh_util.create_distributed_mesh([('x', 4)])
+    self.assertEqual(mesh.num_local_devices(), 4)
+
+  def testDeviceCacheDoesNotKeepContextAlive(self):
+    _configure_logical_cpus(2)
+    mesh_util.create_mesh()
+    old_context = weakref.ref(context.context())
+
+    context._reset_context()  # pylint: disable=protected-access
+    self.assertIsNone(old_context())
+
+  def testCreateDistributedMeshAfterEnvChange(self):
+    _configure_logical_cpus(4)
+    with mock.patch.dict(os.environ, {'DTENSOR_CPU_CORE_COUNT': '2'}):
+      mesh = mesh_util.create_distributed_mesh([('x', 2)])
+    self.assertEqual(mesh.num_local_devices(), 2)
+
+    mesh_util._reset_env_cache()  # pylint: disable=protected-access
+    with mock.patch.dict(os.environ, {'DTENSOR_CPU_CORE_COUNT': '4'}):
+      mesh = mesh_util.create_distributed_mesh([('x', 4)])
+    self.assertEqual(mesh.num_local_devices(), 4)
+
+  def testExplicitArgsIgnoreEnv(self):
+    _configure_logical_cpus(2)
+    with mock.patch.dict(os.environ, {'DTENSOR_CLIENT_ID': ''}):
+      mesh = mesh_util.create_distributed_mesh([('x', 2)],
+                                               num_global_devices=2,
+                                               num_clients=1,
+                                               client_id=0)
+    self.assertEqual(mesh.num_local_devices(), 2)
+
+  def testCreateDistributedMeshShapeMismatch(self):
+    _configure_logical_cpus(2)
+    with self.assertRaisesRegex(ValueError,
+                                'does not match num_global_devices'):
+      mesh_util.create_distributed_mesh([('x', 3)], num_global_devices=2)
+
+  def testMissingArgReadsOnlyItsEnvVar(self):
+    _configure_logical_cpus(2)
+    with mock.patch.dict(os.environ, {'DTENSOR_CLIENT_ID': ''}):
+      mesh = mesh_util.create_distributed_mesh([('x', 2)],
+                                               num_global_devices=2,
+                                               client_id=0)
+    self.assertEqual(mesh.num_local_devices(), 2)
+
+  def testCreateMesh2D(self):
+    _configure_logical_cpus(4)
+    mesh = mesh_util.create_mesh([('x', 2), ('y', 2)])
+    self.assertEqual(mesh.shape(), [2, 2])
+    self.assertEqual(mesh.local_device_ids(), [0, 1, 2, 3])
+
+  def testCreateDistributedMesh2D(self):
+    _configure_logical_cpus(4)
+    mesh = mesh_util.create_distributed_mesh([('x', 2), ('y', 2)])
+    self.assertEqual(mesh.shape(), [2, 2])
+    self.assertEqual(mesh.local_device_ids(), [0, 1, 2, 3])
+
+  def testCreateDistributedMeshSecondClient(self):
+
+    def fake_local_devices(device_type, for_client_id):
+      return [
+          tf_device.DeviceSpec(  # pylint: disable=g-complex-comprehension
+              job='localhost',
+              replica=0,
+              task=for_client_id,
+              device_type=device_type,
+              device_index=i) for i in range(2)
+      ]
+
+    _configure_logical_cpus(2)
+    with mock.patch.object(mesh_util, '_local_devices', fake_local_devices):
+      mesh = mesh_util.create_distributed_mesh([('x', 2), ('y', 2)],
+                                               num_global_devices=4,
+                                               num_clients=2,
+                                               client_id=1)
+    self.assertEqual(mesh.shape(), [2, 2])
+    self.assertEqual(mesh.local_device_ids(), [2, 3])
+
+
+if __name__ == '__main__':
+  test.main()